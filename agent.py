@@ -1,15 +1,59 @@
-from typing import TypedDict, Annotated, Literal, List
+from typing import TypedDict, Annotated, Literal, List, Iterator, Optional
 from langgraph.graph import START, StateGraph, END
+from langgraph.constants import TAG_NOSTREAM
 from langchain_openai import ChatOpenAI
 from langchain_core.messages import HumanMessage, SystemMessage, AIMessage
-from models import AgentThought, ToolResult
-from tools import TOOLS
-from prompts import EXPENSE_AGENT_SYSTEM_PROMPT
-import json
+from models import AgentThought, ToolCall, ToolResult
+from tools import TOOL_DISPATCH, LLM_TOOLS, READ_ONLY_TOOLS, POST_TOOL_FORMATTERS, RESPOND_DIRECTLY_ARG
+from agent_cache import RESPONSE_CACHE, make_cache_key
+from database import get_data_version, SessionLocal
+from sqlalchemy.orm import Session
+from prompts import EXPENSE_AGENT_SYSTEM_PROMPT, render_user_prompt, HISTORY_SUMMARY_PROMPT
+from concurrent.futures import ThreadPoolExecutor
+import operator
+import httpx
+import logging
 from dotenv import load_dotenv
 
 load_dotenv()
 
+# Per-step tracing is logged at DEBUG (%s-style args), so at INFO it is never formatted
+logger = logging.getLogger(__name__)
+
+# Shared HTTP/2 transport with generous keep-alive, so every reasoning step
+# (and concurrent requests) reuse the same TLS connection to OpenAI
+_HTTP = httpx.Client(
+    http2=True,
+    limits=httpx.Limits(
+        max_keepalive_connections=20,
+        max_connections=40,
+        keepalive_expiry=60.0
+    )
+)
+
+# One client for the whole process, so the underlying HTTP connection pool stays warm.
+# Tools are bound natively, so the model returns structured tool_calls instead of JSON text
+_LLM = ChatOpenAI(
+    model="gpt-4o-mini",
+    temperature=0,
+    http_client=_HTTP
+).bind_tools(LLM_TOOLS)
+
+# Cheap one-shot summarizer for long conversations (kept out of /chat/stream output)
+_SUMMARY_LLM = ChatOpenAI(
+    model="gpt-4o-mini",
+    temperature=0,
+    max_tokens=200,
+    http_client=_HTTP
+).with_config(tags=[TAG_NOSTREAM])
+
+_ERROR_ANSWER = "I encountered an error. Please try again."
+
+# Once more than HISTORY_MAX_TURNS turns pile up since the last summary, older
+# turns are summarized and only the last HISTORY_WINDOW are sent verbatim
+HISTORY_WINDOW = 8
+HISTORY_MAX_TURNS = 16
+
 # ============================================================================
 # STATE DEFINITION
 # ============================================================================
@@ -20,80 +64,131 @@ class AgentState(TypedDict):
     """
     user_input: str
     user_id: str
-    conversation_history: List[dict]  # List for {role, content} messages
+    db_session: Session  # one session (one pool checkout) for the whole run
+    conversation_history: Annotated[List[dict], operator.add]  # {role, content} messages; nodes return only new ones
+    history_text: str  # conversation_history already rendered for the prompt
+    history_summary: str  # summary of turns no longer sent verbatim
+    summarized_turns: int  # how many leading turns history_summary covers
     current_thought: AgentThought
     iterations: int
     final_answer: str
     tools_used: List[str]
+    tool_results: List[ToolResult]  # results of the latest tool step, aligned with current_thought.tool_calls
+    tool_failed: bool  # any tool call in this run returned success=False
+
+def _append_history(history_text: str, role: str, content: str) -> str:
+    """Append one rendered turn instead of re-joining the whole history"""
+    line = f"{role}: {content}"
+    return f"{history_text}\n{line}" if history_text else line
+
+def _render_history(turns: List[dict]) -> str:
+    """Render {role, content} turns for the prompt"""
+    return "\n".join(f"{msg['role']}: {msg['content']}" for msg in turns)
+
+def _summarize_history(previous_summary: str, turns: List[dict]) -> str:
+    """Fold older turns (and any earlier summary) into a short summary"""
+    prompt = HISTORY_SUMMARY_PROMPT.format(
+        previous_summary=previous_summary or "(none)",
+        conversation_history=_render_history(turns)
+    )
+    return _SUMMARY_LLM.invoke([HumanMessage(content=prompt)]).content
 
 # ============================================================================
-# AGENT NODE (WITH STRUCTURED OUTPUT!)
+# AGENT NODE (WITH NATIVE TOOL CALLING!)
 # ============================================================================
 
 def agent_reasoning_node(state: AgentState) -> AgentState:
     """
-    Agent's reasoning step using structured output
+    Agent's reasoning step using native tool calling
 
-    No more REGEX, LLM outputs JSON the pydantic validates  
+    No more REGEX, LLM returns tool_calls that pydantic validates  
     """
-    # Initialize LLM with structured output
+    history = state["conversation_history"]
+    history_text = state["history_text"]
+    history_summary = state.get("history_summary", "")
+    summarized_turns = state.get("summarized_turns", 0)
 
-    llm = ChatOpenAI(
-        model = "gpt-4o-mini",
-        temperature =0,
-        model_kwargs={
-            "response_format": {"type": "json_object"}  # Force JSON output
-        }
-    )
-    # Build conversation history
-    history_text = "\n".join([
-        f"{msg['role']}: {msg['content']}"
-        for msg in state["conversation_history"]
-    ])
-    
-    # Build prompt
-    prompt = EXPENSE_AGENT_SYSTEM_PROMPT.format(
+    # Too long? Summarize older turns once and keep only the recent window verbatim
+    if len(history) - summarized_turns > HISTORY_MAX_TURNS:
+        cutoff = len(history) - HISTORY_WINDOW
+        history_summary = _summarize_history(history_summary, history[summarized_turns:cutoff])
+        summarized_turns = cutoff
+        history_text = _render_history(history[cutoff:])
+
+    # Build prompt (only the dynamic part needs formatting)
+    prompt = render_user_prompt(
         conversation_history=history_text,
         user_input=state["user_input"]
     )
     
-    print(f"\n{'='*70}")
-    print(f"🧠 REASONING STEP {state['iterations'] + 1}")
-    print(f"{'='*70}\n")
+    logger.debug("🧠 REASONING STEP %d", state["iterations"] + 1)
     
-    # Call LLM
-    response = llm.invoke([HumanMessage(content=prompt)])
+    # Static system prompt first (cacheable prefix), then summary, then the dynamic part
+    messages = [SystemMessage(content=EXPENSE_AGENT_SYSTEM_PROMPT)]
+    if history_summary:
+        messages.append(SystemMessage(content=f"Summary of earlier conversation:\n{history_summary}"))
+    messages.append(HumanMessage(content=prompt))
+
+    # Call LLM. Under stream_mode="messages" (/chat/stream) LangGraph streams this
+    # call token by token automatically; /chat gets a plain non-streaming request
+    response = _LLM.invoke(messages)
     
-    print(f"🤖 LLM Raw Response:\n{response.content}\n")
+    logger.debug("🤖 LLM Response: %r, tool_calls=%s", response.content, response.tool_calls)
 
-    # Parse JSON response into Pydantic model (NO REGEX!)
+    # Build AgentThought from the tool calls (NO REGEX, NO JSON PARSING!)
     try:
-        thought_data = json.loads(response.content)
-        agent_thought = AgentThought(**thought_data)  # Pydantic validation!
+        if response.invalid_tool_calls:
+            logger.warning("❌ Invalid tool calls from LLM: %s", response.invalid_tool_calls)
+            if not response.tool_calls:
+                # Nothing usable to run; fall back to the error answer below
+                raise ValueError("LLM returned only invalid tool calls")
+
+        if response.tool_calls:
+            tool_calls = [
+                ToolCall(name=call["name"], args=call["args"])
+                for call in response.tool_calls
+            ]
+            agent_thought = AgentThought(
+                thought=response.content or f"Calling {', '.join(call.name for call in tool_calls)}",
+                needs_tool=True,
+                tool_calls=tool_calls
+            )
+        else:
+            # An empty reply is not an answer; use the error answer instead of ""
+            final_answer = response.content or _ERROR_ANSWER
+            agent_thought = AgentThought(
+                thought=final_answer,
+                needs_tool=False,
+                final_answer=final_answer
+            )
         
-        print(f"✅ Parsed AgentThought:")
-        print(f"   Thought: {agent_thought.thought}")
-        print(f"   Needs Tool: {agent_thought.needs_tool}")
-        print(f"   Tool: {agent_thought.tool_name}")
-        print(f"   Input: {agent_thought.tool_input}")
-        print(f"   Final Answer: {agent_thought.final_answer}\n")
+        logger.debug(
+            "✅ Parsed AgentThought: thought=%r needs_tool=%s tool_calls=%s final_answer=%r",
+            agent_thought.thought,
+            agent_thought.needs_tool,
+            agent_thought.tool_calls,
+            agent_thought.final_answer
+        )
         
     except Exception as e:
-        print(f"❌ Error parsing LLM output: {e}")
+        logger.warning("❌ Error parsing LLM output: %s", e)
         # Fallback
         agent_thought = AgentThought(
             thought="Error parsing response",
             needs_tool=False,
-            final_answer="I encountered an error. Please try again."
+            final_answer=_ERROR_ANSWER
         )
     
     # Update state
     return {
         "current_thought": agent_thought,
         "iterations": state["iterations"] + 1,
-        "conversation_history": state["conversation_history"] + [
+        "conversation_history": [
             {"role": "assistant", "content": agent_thought.thought}
         ],
+        "history_text": _append_history(history_text, "assistant", agent_thought.thought),
+        "history_summary": history_summary,
+        "summarized_turns": summarized_turns,
         "final_answer": agent_thought.final_answer or state.get("final_answer", "")
     }
 
@@ -101,50 +196,104 @@ def agent_reasoning_node(state: AgentState) -> AgentState:
 # TOOL EXECUTION NODE
 # ============================================================================
 
+def _execute_tool(tool_call: ToolCall, user_id: str, db: Optional[Session] = None) -> ToolResult:
+    """Run a single tool call, turning failures into a ToolResult"""
+    # Get tool function and its argument validator
+    dispatch = TOOL_DISPATCH.get(tool_call.name)
+    
+    if not dispatch:
+        return ToolResult(
+            success=False,
+            message=f"Unknown tool: {tool_call.name}"
+        )
+
+    tool_func, args_model = dispatch
+    try:
+        # Validate the LLM's args (new object, never mutated), then add user_id.
+        # respond_directly only steers the condense step, the tool never sees it
+        tool_input = args_model(**tool_call.args).model_dump(exclude={RESPOND_DIRECTLY_ARG})
+        return tool_func(**tool_input, user_id=user_id, db=db)
+        
+    except Exception as e:
+        return ToolResult(
+            success=False,
+            message=f"Tool execution error: {str(e)}"
+        )
+
 def tool_execution_node(state: AgentState) -> AgentState:
-    """Execute the tool the agent decided to use"""
+    """
+    Execute the tools the agent decided to use
+
+    Independent tool calls from the same step run concurrently (DB I/O
+    releases the GIL), so wall-clock is max(latencies), not the sum.
+    """
     thought = state["current_thought"]
+    tool_calls = thought.tool_calls
     
-    if not thought.tool_name:
-        return state
-    
-    print(f"{'='*70}")
-    print(f"🔧 EXECUTING TOOL: {thought.tool_name}")
-    print(f"{'='*70}")
-    print(f"Input: {thought.tool_input}\n")
+    if not tool_calls:
+        return {}
     
-    # Get tool function
-    tool_func = TOOLS.get(thought.tool_name)
+    logger.debug("🔧 EXECUTING TOOLS: %s", tool_calls)
     
-    if not tool_func:
-        result = ToolResult(
-            success=False,
-            message=f"Unknown tool: {thought.tool_name}"
-        )
+    if len(tool_calls) == 1:
+        results = [_execute_tool(tool_calls[0], state["user_id"], state.get("db_session"))]
     else:
-        try:
-            # Execute tool with user_id
-            tool_input = thought.tool_input or {}
-            tool_input["user_id"] = state["user_id"]
-            
-            result = tool_func(**tool_input)
-            
-        except Exception as e:
-            result = ToolResult(
-                success=False,
-                message=f"Tool execution error: {str(e)}"
-            )
+        # Sessions are not thread-safe, so concurrent calls each check out their own
+        with ThreadPoolExecutor(max_workers=len(tool_calls)) as pool:
+            results = list(pool.map(
+                lambda call: _execute_tool(call, state["user_id"]),
+                tool_calls
+            ))
     
-    print(f"🔍 Tool Result:\n{result.message}\n")
-    
-    # Add tool result to conversation history
+    # Add tool results to conversation history (in the order the LLM asked for them)
+    new_turns = []
+    history_text = state["history_text"]
+    for call, result in zip(tool_calls, results):
+        logger.debug("🔍 %s result: %s", call.name, result.message)
+        tool_content = f"Tool '{call.name}' result: {result.message}"
+        new_turns.append({"role": "tool", "content": tool_content})
+        history_text = _append_history(history_text, "tool", tool_content)
+
     return {
-        "conversation_history": state["conversation_history"] + [
-            {"role": "tool", "content": f"Tool '{thought.tool_name}' result: {result.message}"}
-        ],
-        "tools_used": state.get("tools_used", []) + [thought.tool_name]
+        "conversation_history": new_turns,
+        "history_text": history_text,
+        "tools_used": state.get("tools_used", []) + [call.name for call in tool_calls],
+        "tool_results": results,
+        "tool_failed": state.get("tool_failed", False) or any(not result.success for result in results)
     }
 
+# ============================================================================
+# CONDENSE NODE (Skip the LLM for simple read-only answers)
+# ============================================================================
+
+def condense_node(state: AgentState) -> AgentState:
+    """
+    Turn read-only tool results straight into the final answer
+
+    Saves a full LLM round-trip for "show my spending" / "check my budgets"
+    style questions. Only taken when the LLM marked every call with
+    respond_directly=true; a read that feeds a follow-up action ("check my
+    budgets and raise food to 300") goes back to the reasoning step.
+    """
+    tool_calls = state["current_thought"].tool_calls
+    results = state.get("tool_results", [])
+
+    condensable = bool(tool_calls) and all(
+        call.name in POST_TOOL_FORMATTERS
+        and call.args.get(RESPOND_DIRECTLY_ARG) is True
+        and result.success
+        for call, result in zip(tool_calls, results)
+    )
+    if not condensable:
+        return {}
+
+    answer = "\n\n".join(
+        POST_TOOL_FORMATTERS[call.name](result)
+        for call, result in zip(tool_calls, results)
+    )
+    logger.debug("📝 Condensed tool results into final answer")
+    return {"final_answer": answer}
+
 # ============================================================================
 # ROUTING LOGIC
 # ============================================================================
@@ -155,22 +304,29 @@ def should_continue(state: AgentState) -> Literal["execute_tool", "finish"]:
     
     # Has final answer?
     if thought.final_answer:
-        print("✅ Decision: FINISH (final answer ready)\n")
+        logger.debug("✅ Decision: FINISH (final answer ready)")
         return "finish"
     
     # Hit iteration limit?
     if state["iterations"] >= 10:
-        print("⚠️ Decision: FINISH (max iterations)\n")
+        logger.info("⚠️ Decision: FINISH (max iterations)")
         return "finish"
     
     # Needs tool?
-    if thought.needs_tool and thought.tool_name:
-        print(f"➡️ Decision: EXECUTE_TOOL ({thought.tool_name})\n")
+    if thought.needs_tool and thought.tool_calls:
+        logger.debug("➡️ Decision: EXECUTE_TOOL (%s)", thought.tool_calls)
         return "execute_tool"
     
-    print("⚠️ Decision: FINISH (no action)\n")
+    logger.debug("⚠️ Decision: FINISH (no action)")
     return "finish"
 
+def after_tools(state: AgentState) -> Literal["reasoning", "finish"]:
+    """Finish if the condense step already produced the answer"""
+    if state.get("final_answer"):
+        logger.debug("✅ Decision: FINISH (condensed tool results)")
+        return "finish"
+    return "reasoning"
+
 # ============================================================================
 # BUILD GRAPH
 # ============================================================================
@@ -182,6 +338,7 @@ def create_expense_agent():
     # Add nodes
     workflow.add_node("reasoning", agent_reasoning_node)
     workflow.add_node("tool_execution", tool_execution_node)
+    workflow.add_node("condense", condense_node)
     
     # Entry point
     workflow.set_entry_point("reasoning")
@@ -196,52 +353,161 @@ def create_expense_agent():
         }
     )
     
-    # Loop back after tool execution
-    workflow.add_edge("tool_execution", "reasoning")
+    # After tools: answer directly if possible, otherwise loop back
+    workflow.add_edge("tool_execution", "condense")
+    workflow.add_conditional_edges(
+        "condense",
+        after_tools,
+        {
+            "reasoning": "reasoning",
+            "finish": END
+        }
+    )
     
     return workflow.compile()
 
+# The graph structure is static, so compile it once and reuse it for every request
+_AGENT = create_expense_agent()
+
 # ============================================================================
 # CONVENIENCE INTERFACE
 # ============================================================================
 
-def chat_with_agent(message: str, user_id: str = "default_user") -> dict:
-    """Simple chat interface"""
-    agent = create_expense_agent()
-    
-    import time
-    start_time = time.time()
-    
-    result = agent.invoke({
+def _initial_state(message: str, user_id: str, db: Session) -> AgentState:
+    """Fresh state for a single agent run"""
+    return {
         "user_input": message,
         "user_id": user_id,
+        "db_session": db,
         "conversation_history": [],
+        "history_text": "",
+        "history_summary": "",
+        "summarized_turns": 0,
         "current_thought": None,
         "iterations": 0,
         "final_answer": "",
-        "tools_used": []
-    })
+        "tools_used": [],
+        "tool_results": [],
+        "tool_failed": False
+    }
+
+def chat_with_agent(message: str, user_id: str = "default_user") -> dict:
+    """Simple chat interface"""
+    import time
+    start_time = time.time()
+
+    # Repeat question with no writes since? Answer from cache without calling OpenAI
+    cache_key = make_cache_key(user_id, message, get_data_version(user_id))
+    cached = RESPONSE_CACHE.get(cache_key)
+    if cached is not None:
+        return {
+            "answer": cached["answer"],
+            "steps_taken": 0,
+            "tools_used": cached["tools_used"],
+            "execution_time": round(time.time() - start_time, 2)
+        }
+    
+    with SessionLocal() as db:
+        result = _AGENT.invoke(_initial_state(message, user_id, db))
     
     execution_time = time.time() - start_time
+
+    answer = result.get("final_answer", "No answer generated")
+    tools_used = result.get("tools_used", [])
+
+    # Never cache after add_expense/set_budget, the answer depends on what was written,
+    # nor after a failed tool call (the answer is an apology that would outlive the outage)
+    cacheable = (
+        answer
+        and answer != _ERROR_ANSWER
+        and not result.get("tool_failed", False)
+        and all(tool in READ_ONLY_TOOLS for tool in tools_used)
+    )
+    if cacheable:
+        RESPONSE_CACHE.set(cache_key, {"answer": answer, "tools_used": tools_used})
     
     return {
-        "answer": result.get("final_answer", "No answer generated"),
+        "answer": answer,
         "steps_taken": result["iterations"],
-        "tools_used": result.get("tools_used", []),
+        "tools_used": tools_used,
         "execution_time": round(execution_time,2)
     }
 
+def stream_chat_with_agent(message: str, user_id: str = "default_user") -> Iterator[dict]:
+    """
+    Streaming chat interface
+
+    Yields {"type": "token", "content": ...} events as soon as the model
+    starts answering, then one {"type": "done", ...} event shaped like
+    chat_with_agent().
+
+    A reasoning step can stream text before it turns out to call tools. When
+    that happens a {"type": "reset"} event follows, and the client should
+    drop the tokens it received since the last reset.
+    """
+    import time
+    start_time = time.time()
+
+    final_answer = ""
+    steps_taken = 0
+    tools_used = []
+    step_tokens = []  # tokens already sent for the reasoning step in progress
+    step_calls_tools = False  # tool_call_chunks seen in the reasoning step in progress
+
+    with SessionLocal() as db:
+        for mode, payload in _AGENT.stream(
+            _initial_state(message, user_id, db),
+            stream_mode=["messages", "updates"]
+        ):
+            if mode == "messages":
+                chunk, metadata = payload
+                if metadata.get("langgraph_node") != "reasoning":
+                    continue
+                if getattr(chunk, "tool_call_chunks", None):
+                    # The text so far was a preamble to tool calls, not the answer
+                    if not step_calls_tools and step_tokens:
+                        yield {"type": "reset"}
+                    step_calls_tools = True
+                elif chunk.content and not step_calls_tools:
+                    step_tokens.append(chunk.content)
+                    yield {"type": "token", "content": chunk.content}
+            else:
+                for node, update in payload.items():
+                    if not update:
+                        continue
+                    if node == "reasoning":
+                        answer = update.get("final_answer", "")
+                        streamed = "".join(step_tokens) if not step_calls_tools else ""
+                        if not update["current_thought"].tool_calls and answer and answer != streamed:
+                            # Fallback (_ERROR_ANSWER) never came from the LLM stream
+                            if streamed:
+                                yield {"type": "reset"}
+                            yield {"type": "token", "content": answer}
+                        step_tokens = []
+                        step_calls_tools = False
+                    # Condensed answers never pass through the LLM, so send them as one token
+                    if node == "condense" and update.get("final_answer"):
+                        yield {"type": "token", "content": update["final_answer"]}
+                    final_answer = update.get("final_answer") or final_answer
+                    steps_taken = update.get("iterations", steps_taken)
+                    tools_used = update.get("tools_used", tools_used)
+
+    yield {
+        "type": "done",
+        "answer": final_answer or "No answer generated",
+        "steps_taken": steps_taken,
+        "tools_used": tools_used,
+        "execution_time": round(time.time() - start_time, 2)
+    }
+
 
 
-# LLM outputs this JSON:
-# {
-#   "thought": "I need to add the expense",
-#   "needs_tool": true,
-#   "tool_name": "add_expense",
-#   "tool_input": {"amount": 50, "category": "food", "description": "lunch"}
-# }
+# LLM returns native tool calls:
+# response.tool_calls == [
+#   {"name": "add_expense", "args": {"amount": 50, "category": "food", "description": "lunch"}, "id": "call_..."}
+# ]
 
-# # We parse with Pydantic:
-# agent_thought = AgentThought(**json.loads(response.content))
+# # We build the thought with Pydantic:
+# agent_thought = AgentThought(thought=..., needs_tool=True, tool_calls=[ToolCall(name=..., args=...)])
 
 # # Type-safe! Validated! No regex fragility!
\ No newline at end of file
@@ -0,0 +1,67 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+# ============================================================================
+# TTL + LRU CACHE (In-process, thread-safe)
+# ============================================================================
+
+class TTLCache:
+    """
+    Small LRU cache whose entries expire after `ttl` seconds
+
+    Why not functools.lru_cache?
+    - Entries need to expire (spending data changes)
+    - We store results after the call, not memoize a function
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 300.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Return the cached value, or None if missing/expired"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        """Store a value, evicting the least recently used entry if full"""
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+# ============================================================================
+# AGENT RESPONSE CACHE
+# ============================================================================
+
+def make_cache_key(user_id: str, message: str, data_version: int = 0) -> str:
+    """
+    Key on user + data version + normalized message
+
+    "Show my summary " == "show my summary", and any write for the user
+    (which bumps data_version) makes older entries unreachable
+    """
+    normalized = " ".join(message.lower().split())
+    raw = f"{user_id}|{data_version}|{normalized}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+# Answers for repeat questions; only read-only runs are stored (see chat_with_agent)
+RESPONSE_CACHE = TTLCache(maxsize=1024, ttl=300)
@@ -1,12 +1,15 @@
 from fastapi import FastAPI, Depends, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
-from database import get_db, ExpenseRepository
+from database import get_db, ExpenseRepository, SessionLocal
 from models import ChatRequest, ChatResponse, ExpenseCreate, Expense
-from agent import chat_with_agent
+from agent import chat_with_agent, stream_chat_with_agent
 from typing import List
 from contextlib import asynccontextmanager
 import traceback
+import json
 import logging
 from sqlalchemy import text
 
@@ -64,7 +67,9 @@ async def chat_endpoint(request: ChatRequest):
     try:
         logger.info(f"Received request: {request.message} from user {request.user_id}")
         
-        result = chat_with_agent(request.message, request.user_id)
+        # The agent (LLM + DB calls) is blocking; run it in the threadpool
+        # so the event loop keeps serving other requests meanwhile
+        result = await run_in_threadpool(chat_with_agent, request.message, request.user_id)
         
         logger.info(f"Agent response: {result}")
         return ChatResponse(**result)
@@ -83,13 +88,40 @@ async def chat_endpoint(request: ChatRequest):
                 "traceback": traceback.format_exc()
             }
         )
+
+@app.post("/chat/stream")
+async def chat_stream_endpoint(request: ChatRequest):
+    """
+    Chat with the expense agent, streaming the answer as Server-Sent Events
+
+    Token events arrive as soon as the model starts answering,
+    followed by a final "done" event with the full ChatResponse fields.
+    A "reset" event means the tokens since the last reset were a preamble
+    to tool calls and should be discarded.
+    """
+    logger.info(f"Received stream request: {request.message} from user {request.user_id}")
+
+    def event_stream():
+        try:
+            for event in stream_chat_with_agent(request.message, request.user_id):
+                yield f"data: {json.dumps(event)}\n\n"
+        except Exception as e:
+            logger.error(f"Error in chat stream: {str(e)}")
+            logger.error(f"Full traceback: {traceback.format_exc()}")
+            error = {"type": "error", "error": str(e), "error_type": type(e).__name__}
+            yield f"data: {json.dumps(error)}\n\n"
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
     
 # ============================================================================
 # DIRECT DATABASE ENDPOINTS (Bypass Agent)
 # ============================================================================
 
+# These use the sync SQLAlchemy session, so they are plain `def`:
+# FastAPI runs them in its threadpool instead of blocking the event loop
+
 @app.post("/expenses", response_model=Expense)
-async def create_expense_direct(
+def create_expense_direct(
     expense: ExpenseCreate,
     user_id: str = "default_user",
     db: Session = Depends(get_db)
@@ -102,7 +134,7 @@ async def create_expense_direct(
     return repo.create_expenses(expense, user_id)
 
 @app.get("/expenses", response_model=List[Expense])
-async def get_expenses(
+def get_expenses(
     user_id: str = "default_user",
     category: str = None,
     db: Session = Depends(get_db)
@@ -112,14 +144,14 @@ async def get_expenses(
     return repo.get_expenses_by_category(user_id, category)
 
 @app.get("/expenses/summary")
-async def get_expense_summary(
+def get_expense_summary(
     user_id: str = "default_user",
     db: Session = Depends(get_db)
 ):
     """Get spending summary by category"""
     repo = ExpenseRepository(db)
     return {
-        "totals": repo.get_total_by_category(user_id),
+        "totals": dict(repo.get_total_by_category(user_id)),
         "alerts": repo.check_budget_alerts(user_id)
     }
 
@@ -128,11 +160,11 @@ async def get_expense_summary(
 # ============================================================================
 
 @app.get("/health")
-async def health_check():
+def health_check():
     """Check if API and database are running"""
     try:
-        db = next(get_db())
-        db.execute(text("SELECT 1"))
+        with SessionLocal() as db:
+            db.execute(text("SELECT 1"))
         return {"status": "healthy", "database": "connected"}
     except Exception as e:
         raise HTTPException(status_code=503, detail=f"Database error: {str(e)}")
@@ -1,10 +1,10 @@
-from sqlalchemy import create_engine, Column, Integer, Float, String, DateTime, Index
+from sqlalchemy import create_engine, Column, Integer, SmallInteger, Float, String, DateTime, Index, func, and_, insert, select, bindparam
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
-from datetime import datetime, timezone
 from typing import List, Optional
-from models import Expense as ExpenseSchema, Budget as BudgetSchema
+from models import Expense as ExpenseSchema, Budget as BudgetSchema, ExpenseCreate, Category
 import os
+import threading
 from dotenv import load_dotenv
 load_dotenv()
 # ============================================================================
@@ -20,14 +20,18 @@ DB_URI = os.getenv(
 
 engine = create_engine(
     DB_URI,
-    pool_size = 10,     # Connection Pool size
-    max_overflow = 20,  # Max Extra connections
+    pool_size = (os.cpu_count() or 1) * 2 + 1,  # Connection Pool size: (cores * 2) + 1
+    max_overflow = 10,  # Max Extra connections
     pool_pre_ping = True,  # Verfiy connections before use
+    pool_recycle = 1800,  # Replace connections older than 30 min (server/proxy idle timeouts)
     echo= False  # Set true to see sql queries
 )
 
 # create session factory
-SessionLocal = sessionmaker(autocommit = False, autoflush = False, bind = engine)
+# expire_on_commit=False: objects stay readable after commit without re-SELECTing.
+# Plain sessionmaker (not scoped_session): every unit of work gets its own session,
+# and a thread-local registry would be shared by FastAPI requests on the same worker thread
+SessionLocal = sessionmaker(autocommit = False, autoflush = False, expire_on_commit = False, bind = engine)
 
 
 # base class for models
@@ -52,14 +56,15 @@ class ExpenseTable(Base):
 
     id = Column(Integer, primary_key = True, index = True)
     amount = Column(Float, nullable=False)
-    category = Column(String(50), nullable=False, index=True)  # Index for fast category queries
+    category = Column(SmallInteger, nullable=False)  # Category code; covered by idx_user_category_amount below
     description = Column(String(200), nullable=False)
     user_id = Column(String(100), nullable=False, default="default_user", index=True)
-    created_at = Column(DateTime, default=datetime.now(timezone.utc), nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)  # NOW() at insert time
 
-    # composite index for user + category queries (very common)
+    # composite index for user + category queries (very common);
+    # INCLUDE amount so SUM(amount) ... GROUP BY category is an index-only scan
     __table_args__ = (
-        Index('idx_user_category', 'user_id', 'category'),
+        Index('idx_user_category_amount', 'user_id', 'category', postgresql_include=['amount']),
     )
 
 class BudgetTable(Base):
@@ -67,15 +72,19 @@ class BudgetTable(Base):
     __tablename__ = "budgets"
     
     id = Column(Integer, primary_key=True, index=True)
-    category = Column(String(50), nullable=False)
+    category = Column(SmallInteger, nullable=False)  # Category code
     amount = Column(Float, nullable=False)
     user_id = Column(String(100), nullable=False, default="default_user")
-    created_at = Column(DateTime, default=datetime.now(timezone.utc), nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)  # NOW() at insert time
     
     __table_args__ = (
         Index('idx_user_budget_category', 'user_id', 'category', unique=True),  # One budget per category per user
     )
 
+    # Fetch server-generated columns (created_at) with INSERT ... RETURNING
+    # instead of a follow-up SELECT
+    __mapper_args__ = {"eager_defaults": True}
+
 # ============================================================================
 # CREATE TABLES
 # ===========================================================================
@@ -87,10 +96,107 @@ def init_db():
     Base.metadata.create_all(bind = engine)
     print("✅ Database tables created successfully!")
 
+# ============================================================================
+# ROW CONVERSION (ORM -> Pydantic)
+# ============================================================================
+
+def _category_code(category: str) -> Optional[int]:
+    """Category name (any case) -> SMALLINT code stored in the tables (None if unknown)"""
+    member = Category.__members__.get(category.lower())
+    return member.value if member is not None else None
+
+# Rows come from our own typed tables, so skip Pydantic validation here;
+# user input is still validated at the API/tool boundary
+
+def _expense_from_orm(row) -> ExpenseSchema:
+    return ExpenseSchema.model_construct(
+        id=row.id,
+        amount=row.amount,
+        category=Category(row.category).name,
+        description=row.description,
+        user_id=row.user_id,
+        created_at=row.created_at
+    )
+
+def _budget_from_orm(row) -> BudgetSchema:
+    return BudgetSchema.model_construct(
+        id=row.id,
+        category=Category(row.category).name,
+        amount=row.amount,
+        user_id=row.user_id,
+        created_at=row.created_at
+    )
+
+# ============================================================================
+# DATA VERSIONS (Cache invalidation)
+# ============================================================================
+
+# Bumped on every write for a user; caches mix it into their keys so a single
+# integer bump invalidates every cached read for that user
+_USER_VERSION: dict[str, int] = {}
+_USER_VERSION_LOCK = threading.Lock()
+
+def get_data_version(user_id: str) -> int:
+    """Current data version for a user"""
+    return _USER_VERSION.get(user_id, 0)
+
+def bump_data_version(user_id: str) -> None:
+    """Mark a user's data as changed"""
+    with _USER_VERSION_LOCK:
+        _USER_VERSION[user_id] = _USER_VERSION.get(user_id, 0) + 1
+
+# ============================================================================
+# PREPARED STATEMENTS (Built once at import)
+# ============================================================================
+
+# Hot read queries as Core select()s with bind parameters: the same construct
+# object is reused on every call, so SQLAlchemy's compiled cache hits every time
+
+_STMT_TOTAL_BY_CAT = select(
+    ExpenseTable.category,
+    func.sum(ExpenseTable.amount).label('total')
+).where(
+    ExpenseTable.user_id == bindparam('uid')
+).group_by(
+    ExpenseTable.category
+)
+
+_STMT_CATEGORY_TOTALS = select(
+    func.count(ExpenseTable.id).label('count'),
+    func.coalesce(func.sum(ExpenseTable.amount), 0).label('total')
+).where(
+    ExpenseTable.user_id == bindparam('uid'),
+    ExpenseTable.category == bindparam('cat')
+)
+
+_SPENT = func.coalesce(func.sum(ExpenseTable.amount), 0)
+
+_STMT_BUDGET_ALERTS = select(
+    BudgetTable.category,
+    BudgetTable.amount,
+    _SPENT.label('spent')
+).outerjoin(
+    ExpenseTable,
+    and_(
+        ExpenseTable.user_id == BudgetTable.user_id,
+        ExpenseTable.category == BudgetTable.category
+    )
+).where(
+    BudgetTable.user_id == bindparam('uid')
+).group_by(
+    BudgetTable.category,
+    BudgetTable.amount
+).having(
+    _SPENT > BudgetTable.amount
+)
+
 # ============================================================================
 # DATABASE OPERATIONS (The "Repository Pattern")
 # ============================================================================
 
+# Max rows per INSERT round-trip in create_expenses_bulk
+INSERT_BATCH_SIZE = 1000
+
 class ExpenseRepository:
     """  
     Repository pattern: All database operations in one place
@@ -109,17 +215,51 @@ class ExpenseRepository:
         """
         Add new expense to database  
         """
-        db_expense = ExpenseTable(
-            amount = expense.amount,
-            category = expense.category,
-            description = expense.description,
-            user_id = user_id
+        return self.create_expenses_bulk([expense], user_id)[0]
+
+    def create_expenses_bulk(self, expenses: List[ExpenseCreate], user_id: str = "default_user") -> List[ExpenseSchema]:
+        """
+        Add many expenses with INSERT ... RETURNING and a single commit
+
+        Rows are sent in batches of INSERT_BATCH_SIZE, so N expenses cost
+        ceil(N / INSERT_BATCH_SIZE) round-trips. id and created_at come back
+        from the INSERT itself, so there is no refresh() SELECT per row
+        """
+        if not expenses:
+            return []
+
+        rows = [
+            {
+                "amount": expense.amount,
+                "category": Category[expense.category].value,
+                "description": expense.description,
+                "user_id": user_id
+            }
+            for expense in expenses
+        ]
+        stmt = insert(ExpenseTable).returning(
+            ExpenseTable.id,
+            ExpenseTable.created_at,
+            sort_by_parameter_order=True  # RETURNING rows line up with `rows`
         )
-        self.db.add(db_expense)
+        returned = []
+        for start in range(0, len(rows), INSERT_BATCH_SIZE):
+            batch = rows[start:start + INSERT_BATCH_SIZE]
+            returned.extend(self.db.execute(stmt, batch).all())
         self.db.commit()
-        self.db.refresh(db_expense)
+        bump_data_version(user_id)
 
-        return ExpenseSchema.model_validate(db_expense)
+        return [
+            ExpenseSchema.model_construct(
+                id=ret.id,
+                amount=expense.amount,
+                category=expense.category,
+                description=expense.description,
+                user_id=user_id,
+                created_at=ret.created_at
+            )
+            for expense, ret in zip(expenses, returned)
+        ]
     
     def get_expenses_by_category(self, user_id: str, category: Optional[str] = None) -> List[ExpenseSchema]:
         """
@@ -128,77 +268,87 @@ class ExpenseRepository:
 
         query = self.db.query(ExpenseTable).filter(ExpenseTable.user_id == user_id)
         if category:
-            query = query.filter(ExpenseTable.category == category)
+            # Unknown names map to None -> IS NULL -> no rows (column is NOT NULL)
+            query = query.filter(ExpenseTable.category == _category_code(category))
 
         expenses = query.order_by(ExpenseTable.created_at.desc()).all()
-        return [ExpenseSchema.model_validate(e) for e in expenses]
+        return [_expense_from_orm(e) for e in expenses]
     
 
-    def get_total_by_category(self, user_id: str) -> dict:
+    def get_total_by_category(self, user_id: str) -> List[tuple[str, float]]:
         """
-        Get total spending per category  
+        Get total spending per category as (category, total) pairs  
         """
-        from sqlalchemy import func
-
-        result = self.db.query(
-            ExpenseTable.category,
-            func.sum(ExpenseTable.amount).label('total')
-        ).filter(
-            ExpenseTable.user_id == user_id
-        ).group_by(
-            ExpenseTable.category
-        ).all()
+        result = self.db.execute(_STMT_TOTAL_BY_CAT, {"uid": user_id}).all()
+
+        return [(Category(row.category).name, float(row.total)) for row in result]
+    
+    def get_category_totals(self, user_id: str, category: str) -> tuple[int, float]:
+        """
+        Get (expense count, total spent) for one category
+
+        Aggregated in SQL, so one row comes back instead of every expense
+        """
+        count, total = self.db.execute(
+            _STMT_CATEGORY_TOTALS,
+            {"uid": user_id, "cat": _category_code(category)}
+        ).one()
 
-        return {row.category: float(row.total) for row in result}
+        return count, float(total)
     
     def set_budget(self, category: str, amount: float, user_id: str = "default_user") -> BudgetSchema:
         """Set or update budget for a category"""
+        category_code = _category_code(category)
+        if category_code is None:
+            raise ValueError(f"Unknown category: {category}")
+
         # Check if budget exists
         existing = self.db.query(BudgetTable).filter(
             BudgetTable.user_id == user_id,
-            BudgetTable.category == category
+            BudgetTable.category == category_code
         ).first()
         
         if existing:
             existing.amount = amount
-            self.db.commit()
-            self.db.refresh(existing)
-            return BudgetSchema.from_orm(existing)
+            self.db.commit()  # expire_on_commit=False: attributes stay loaded, no refresh needed
+            bump_data_version(user_id)
+            return _budget_from_orm(existing)
         else:
             new_budget = BudgetTable(
-                category=category,
+                category=category_code,
                 amount=amount,
                 user_id=user_id
             )
             self.db.add(new_budget)
-            self.db.commit()
-            self.db.refresh(new_budget)
-            return BudgetSchema.from_orm(new_budget)
+            self.db.commit()  # eager_defaults: id/created_at already came back via RETURNING
+            bump_data_version(user_id)
+            return _budget_from_orm(new_budget)
     
     def get_budgets(self, user_id: str) -> List[BudgetSchema]:
         """Get all budgets for a user"""
         budgets = self.db.query(BudgetTable).filter(
             BudgetTable.user_id == user_id
         ).all()
-        return [BudgetSchema.from_orm(b) for b in budgets]
+        return [_budget_from_orm(b) for b in budgets]
     
     def check_budget_alerts(self, user_id: str) -> List[dict]:
-        """Check which categories are over budget"""
-        budgets = self.get_budgets(user_id)
-        totals = self.get_total_by_category(user_id)
-        
-        alerts = []
-        for budget in budgets:
-            spent = totals.get(budget.category, 0)
-            if spent > budget.amount:
-                alerts.append({
-                    "category": budget.category,
-                    "budget": budget.amount,
-                    "spent": spent,
-                    "overage": spent - budget.amount
-                })
+        """
+        Check which categories are over budget
+
+        One round-trip: budgets LEFT JOIN expense sums, filtered in SQL
+        so only over-budget rows come back
+        """
+        rows = self.db.execute(_STMT_BUDGET_ALERTS, {"uid": user_id}).all()
         
-        return alerts
+        return [
+            {
+                "category": Category(row.category).name,
+                "budget": row.amount,
+                "spent": float(row.spent),
+                "overage": float(row.spent) - row.amount
+            }
+            for row in rows
+        ]
     
 # ============================================================================
 # DATABASE DEPENDENCY (For FastAPI)
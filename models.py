@@ -8,22 +8,44 @@
 from pydantic import BaseModel, Field, field_validator
 from datetime import datetime
 from typing import Optional, List, Literal
+from enum import IntEnum
 
 # ============================================================================
 # DATABASE MODELS (What we store in PostgreSQL)
 # ============================================================================
 
+class Category(IntEnum):
+    """
+    Expense categories
+
+    Stored as SMALLINT codes in PostgreSQL (smaller rows, integer GROUP BY);
+    everything outside the database layer uses the names.
+    """
+    food = 1
+    transport = 2
+    entertainment = 3
+    shopping = 4
+    bills = 5
+    other = 6
+
+CategoryName = Literal["food", "transport", "entertainment", "shopping", "bills", "other"]
+
+
 class ExpenseCreate(BaseModel):
     """
     Schema for creating a new expense  
     """
     amount: float = Field(..., gt=0, description="Amount spent in dollars")
-    category: Literal["food", "transport", "entertainment", "shopping", "bills", "other"]
+    category: CategoryName
     description: str = Field(..., min_length=1, max_length=200)
 
     @field_validator('amount')
     def round_amount(cls,v):
         return round(v,2)
+
+    @field_validator('category', mode='before')
+    def lowercase_category(cls, v):
+        return v.lower() if isinstance(v, str) else v
     
 
 class Expense(BaseModel):
@@ -45,9 +67,13 @@ class BudgetCreate(BaseModel):
     """
     Schema for setting a budget
     """
-    category: str
+    category: CategoryName
     amount: float = Field(..., gt = 0)
 
+    @field_validator('category', mode='before')
+    def lowercase_category(cls, v):
+        return v.lower() if isinstance(v, str) else v
+
 
 class Budget(BaseModel):
     """
@@ -67,17 +93,23 @@ class Budget(BaseModel):
 # AGENT MODELS (What the LLM outputs) - NO MORE REGEX!
 # ============================================================================
 
+class ToolCall(BaseModel):
+    """
+    A single tool call requested by the LLM
+    """
+    name: str = Field(..., description="Which tool to use")
+    args: dict = Field(default_factory=dict, description="Arguments for the tool")
+
 class AgentThought(BaseModel):
     """
     The agent's reasoning step
 
-    LLM will output JSON matching this schema!
+    Built from the LLM's native tool calls!
     No regex parsing needed!   
     """
     thought: str = Field(..., description = "What the agent is thinking")
     needs_tool: bool = Field(..., description="Does the agent need to use a tool?")
-    tool_name: Optional[str] = Field(None, description="Which tool to use")
-    tool_input: Optional[dict] = Field(None, description="Arguments for the tool")
+    tool_calls: List[ToolCall] = Field(default_factory=list, description="Tools to run (concurrently) this step")
     final_answer: Optional[str] = Field(None, description="Final response if task is complete")
 
 class ToolResult(BaseModel):
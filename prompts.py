@@ -1,44 +1,38 @@
 # prompts.py
 
 # ============================================================================
-# MODERN PROMPT (Uses JSON Schema, No Regex!)
+# MODERN PROMPT (Native Tool Calling, No Regex!)
 # ============================================================================
 
 # prompts.py - Updated version
 
+# Static instructions go first (as the system message) so OpenAI's automatic
+# prompt caching can reuse the prefix across every reasoning step
 EXPENSE_AGENT_SYSTEM_PROMPT = """You are an intelligent Expense Tracking Assistant helping users manage their finances.
 
-Available tools:
-1. add_expense(amount: float, category: str, description: str) - Add new expense
-2. get_spending_summary(category: str = None) - Get spending totals  
-3. set_budget(category: str, amount: float) - Set spending limits
-4. check_budgets() - Check budget alerts
-
 Categories: food, transport, entertainment, shopping, bills, other
 
-CRITICAL: You MUST respond with ONLY valid JSON. No text before or after the JSON.
+Rules:
+1. If you need information or need to change data, call the appropriate tool
+2. After getting tool results, answer the user directly
+3. Keep answers short and specific to the user's expenses
+4. Set respond_directly=true on get_spending_summary/check_budgets only when that result alone answers the user; omit it if you still need to do something (e.g. set a budget)
+"""
 
-JSON Schema:
-{{
-  "thought": "string (your reasoning)",
-  "needs_tool": boolean (true if you need to use a tool, false if you can answer directly),
-  "tool_name": "string or null (name of tool to use)",
-  "tool_input": {{}} or null (arguments for the tool),
-  "final_answer": "string or null (your final response to the user)"
-}}
+# Dynamic part of the prompt, sent as the user message on every step.
+# A plain f-string: no template parsing or regex work per call
+def render_user_prompt(conversation_history: str, user_input: str) -> str:
+    return f"Conversation:\n{conversation_history}\n\nUser: {user_input}\n"
 
-Rules:
-1. If you need information, set needs_tool=true and specify which tool
-2. After getting tool results, provide final_answer
-3. Always output valid JSON only
-4. Do not include any text outside the JSON object
+# Used once the conversation grows too long, to fold older turns into a summary
+HISTORY_SUMMARY_PROMPT = """Summarize the conversation below between a user and an expense tracking assistant.
+Keep every amount, category and tool result that may matter later. Be brief.
+
+Earlier summary:
+{previous_summary}
 
 Conversation:
 {conversation_history}
-
-User: {user_input}
-
-Your JSON response:
 """
 
 
@@ -71,11 +65,8 @@ def format_tools_for_prompt() -> str:
 # """
 # # Then parse with regex 😱
 
-# # ✅ NEW (Structured output)
-# {
-#   "thought": "I should add the expense",
-#   "needs_tool": true,
-#   "tool_name": "add_expense",
-#   "tool_input": {"amount": 50, "category": "food", "description": "lunch"}
-# }
-# # Parse with Pydantic! Type-safe! 🎉
\ No newline at end of file
+# # ✅ NEW (Native tool calling)
+# response.tool_calls == [
+#   {"name": "add_expense", "args": {"amount": 50, "category": "food", "description": "lunch"}, "id": "call_..."}
+# ]
+# # Validate with Pydantic! Type-safe! 🎉
\ No newline at end of file
@@ -1,16 +1,111 @@
-from typing import Optional
-from models import ExpenseCreate, ToolResult
-from database import ExpenseRepository, get_db
+from typing import Optional, Callable, List
+from functools import wraps
+import inspect
+from pydantic import BaseModel, TypeAdapter, create_model
+from models import ExpenseCreate, BudgetCreate, ToolResult
+from sqlalchemy.orm import Session
+from database import ExpenseRepository, SessionLocal, get_data_version
+from agent_cache import TTLCache
+
+# ============================================================================
+# SESSION HANDLING + ERROR HANDLING (Shared by every tool)
+# ============================================================================
+
+def tool_session(tool_func: Callable[..., ToolResult]) -> Callable[..., ToolResult]:
+    """
+    Give a tool a database session and standardize its error handling
+
+    - Reuses the agent run's session when called with db=...,
+      otherwise checks one out of the pool (returned on exit)
+    - Ends the shared session's transaction after every call, so its
+      connection goes back to the pool during the next LLM call
+    - Any exception becomes ToolResult(success=False, ...)
+    """
+    @wraps(tool_func)
+    def wrapper(*args, db: Optional[Session] = None, **kwargs) -> ToolResult:
+        try:
+            if db is not None:
+                result = tool_func(*args, db=db, **kwargs)
+                db.commit()  # no-op for writes (already committed); ends a read's transaction
+                return result
+            with SessionLocal() as session:
+                return tool_func(*args, db=session, **kwargs)
+
+        except Exception as e:
+            if db is not None:
+                db.rollback()  # keep the shared session usable for the next tool call
+            return ToolResult(
+                success=False,
+                message=f"✗ Error: {str(e)}",
+                data=None
+            )
+    return wrapper
+
+# ============================================================================
+# MESSAGE FORMATTING
+# ============================================================================
+
+def format_money(amount: float) -> str:
+    """Dollar amount with cents, e.g. 12.5 -> $12.50"""
+    return f"${amount:.2f}"
+
+# ============================================================================
+# READ CACHE (Short-lived, for repeated read-only tool calls)
+# ============================================================================
+
+# The agent often calls the same read tool several times within one turn.
+# Keys include the user's data version, so any write (which bumps it)
+# makes older entries unreachable before the TTL runs out
+READ_CACHE = TTLCache(maxsize=1024, ttl=5.0)
+
+def read_cached(tool_func: Callable[..., ToolResult]) -> Callable[..., ToolResult]:
+    """
+    Serve repeated calls of a read-only tool from READ_CACHE
+
+    Keyed on (tool, arguments except db, data version); only successful
+    results are stored
+    """
+    signature = inspect.signature(tool_func)
+
+    @wraps(tool_func)
+    def wrapper(*args, **kwargs) -> ToolResult:
+        bound = signature.bind_partial(*args, **kwargs)
+        bound.apply_defaults()
+        params = tuple((name, value) for name, value in bound.arguments.items() if name != "db")
+        user_id = bound.arguments["user_id"]
+        key = (tool_func.__name__, params, get_data_version(user_id))
+
+        cached = READ_CACHE.get(key)
+        if cached is not None:
+            return cached
+
+        result = tool_func(*args, **kwargs)
+        if result.success:
+            READ_CACHE.set(key, result)
+        return result
+    return wrapper
+
+# ============================================================================
+# INPUT VALIDATORS (Built once at import)
+# ============================================================================
+
+_EXPENSE_ADAPTER = TypeAdapter(ExpenseCreate)
+_BUDGET_ADAPTER = TypeAdapter(BudgetCreate)
+# Validates a whole batch in one pass instead of constructing models row by row
+_EXPENSE_LIST_ADAPTER = TypeAdapter(List[ExpenseCreate])
 
 # ============================================================================
 # TOOL DEFINITIONS (No Database Knowledge!)
 # ============================================================================
 
+@tool_session
 def add_expense_tool(
         amount: float,
         category: str,
         description: str,
-        user_id: str = "default_user"
+        user_id: str = "default_user",
+        *,
+        db: Session
 ) -> ToolResult:
     """
     Add a new expense
@@ -18,133 +113,168 @@ def add_expense_tool(
     This tool ONLY knows about business logic.
     Database operations delegated to repository.
     """
-    try:
-        # validate input using pydantic
-        expense_data = ExpenseCreate(
-            amount = amount,
-            category = category,
-            description = description
-        )
+    # validate input using pydantic
+    expense_data = _EXPENSE_ADAPTER.validate_python({
+        "amount": amount,
+        "category": category,
+        "description": description
+    })
 
-        # get database session
-        db = next(get_db())
-        repo = ExpenseRepository(db)
+    # create expense
+    repo = ExpenseRepository(db)
+    expense = repo.create_expenses(expense_data, user_id)
 
-        # create expense
-        expense = repo.create_expenses(expense_data, user_id)
+    return ToolResult(
+        success=True,
+        message=f"✓ Expense added: {format_money(expense.amount)} for {expense.category}",
+        data={"expense_id": expense.id, "amount": expense.amount}
+    )
 
-        return ToolResult(
-            success=True,
-            message=f"✓ Expense added: ${expense.amount} for {expense.category}",
-            data={"expense_id": expense.id, "amount": expense.amount}
-        )
+@tool_session
+def add_expenses_bulk_tool(
+        expenses: List[dict],
+        user_id: str = "default_user",
+        *,
+        db: Session
+) -> ToolResult:
+    """
+    Add many expenses at once (e.g. importing receipts)
 
-    except Exception as e:
-        return ToolResult(
-            success=False,
-            message=f"✗ Error adding expense: {str(e)}",
-            data=None
-        )
-    
+    One validation pass, batched INSERTs and a single commit,
+    instead of one add_expense round-trip per row.
+    """
+    expense_data = _EXPENSE_LIST_ADAPTER.validate_python(expenses)
+
+    repo = ExpenseRepository(db)
+    created = repo.create_expenses_bulk(expense_data, user_id)
+
+    total = sum(expense.amount for expense in created)
+    return ToolResult(
+        success=True,
+        message=f"✓ Added {len(created)} expenses totalling {format_money(total)}",
+        data={"expense_ids": [expense.id for expense in created], "count": len(created)}
+    )
+
+@read_cached
+@tool_session
 def get_spending_summary_tool(
     category: Optional[str] = None,
-    user_id: str = "default_user"
+    user_id: str = "default_user",
+    *,
+    db: Session
 ) -> ToolResult:
     """Get spending summary"""
-    try:
-        db = next(get_db())
-        repo = ExpenseRepository(db)
-        
-        if category:
-            expenses = repo.get_expenses_by_category(user_id, category)
-            total = sum(e.amount for e in expenses)
-            message = f"Category '{category}': {len(expenses)} expenses, Total: ${total:.2f}"
-        else:
-            totals = repo.get_total_by_category(user_id)
-            message = "Spending by category:\n"
-            grand_total = 0
-            for cat, amount in totals.items():
-                message += f"  • {cat.capitalize()}: ${amount:.2f}\n"
-                grand_total += amount
-            message += f"Grand Total: ${grand_total:.2f}"
-        
-        return ToolResult(
-            success=True,
-            message=message,
-            data={"totals": totals if not category else {category: total}}
-        )
-        
-    except Exception as e:
-        return ToolResult(
-            success=False,
-            message=f"✗ Error: {str(e)}",
-            data=None
-        )
+    repo = ExpenseRepository(db)
+    
+    if category:
+        count, total = repo.get_category_totals(user_id, category)
+        totals = {category: total}
+        message = f"Category '{category}': {count} expenses, Total: {format_money(total)}"
+    else:
+        # One pass builds the message lines, the totals payload and the grand total
+        lines = ["Spending by category:"]
+        totals = {}
+        grand_total = 0.0
+        for cat, amount in repo.get_total_by_category(user_id):
+            lines.append(f"  • {cat.capitalize()}: {format_money(amount)}")
+            totals[cat] = amount
+            grand_total += amount
+        lines.append(f"Grand Total: {format_money(grand_total)}")
+        message = "\n".join(lines)
+    
+    return ToolResult(
+        success=True,
+        message=message,
+        data={"totals": totals}
+    )
 
+@tool_session
 def set_budget_tool(
     category: str,
     amount: float,
-    user_id: str = "default_user"
+    user_id: str = "default_user",
+    *,
+    db: Session
 ) -> ToolResult:
     """Set budget for a category"""
-    try:
-        db = next(get_db())
-        repo = ExpenseRepository(db)
-        
-        budget = repo.set_budget(category, amount, user_id)
-        
-        return ToolResult(
-            success=True,
-            message=f"✓ Budget set for {category}: ${amount}",
-            data={"category": budget.category, "amount": budget.amount}
-        )
-        
-    except Exception as e:
-        return ToolResult(
-            success=False,
-            message=f"✗ Error: {str(e)}",
-            data=None
-        )
+    # validate input using pydantic
+    budget_data = _BUDGET_ADAPTER.validate_python({
+        "category": category,
+        "amount": amount
+    })
+
+    repo = ExpenseRepository(db)
+    budget = repo.set_budget(budget_data.category, budget_data.amount, user_id)
+    
+    return ToolResult(
+        success=True,
+        message=f"✓ Budget set for {budget.category}: {format_money(budget.amount)}",
+        data={"category": budget.category, "amount": budget.amount}
+    )
 
-def check_budgets_tool(user_id: str = "default_user") -> ToolResult:
+@read_cached
+@tool_session
+def check_budgets_tool(user_id: str = "default_user", *, db: Session) -> ToolResult:
     """Check budget alerts"""
-    try:
-        db = next(get_db())
-        repo = ExpenseRepository(db)
-        
-        alerts = repo.check_budget_alerts(user_id)
-        
-        if not alerts:
-            message = "✓ All categories within budget!"
-        else:
-            message = "⚠️ BUDGET ALERTS:\n"
-            for alert in alerts:
-                message += f"  • {alert['category']}: ${alert['spent']:.2f} spent (budget: ${alert['budget']:.2f}), over by ${alert['overage']:.2f}\n"
-        
-        return ToolResult(
-            success=True,
-            message=message,
-            data={"alerts": alerts}
-        )
-        
-    except Exception as e:
-        return ToolResult(
-            success=False,
-            message=f"✗ Error: {str(e)}",
-            data=None
+    repo = ExpenseRepository(db)
+    alerts = repo.check_budget_alerts(user_id)
+    
+    if not alerts:
+        message = "✓ All categories within budget!"
+    else:
+        parts = ["⚠️ BUDGET ALERTS:\n"]
+        parts.extend(
+            f"  • {alert['category']}: {format_money(alert['spent'])} spent (budget: {format_money(alert['budget'])}), over by {format_money(alert['overage'])}\n"
+            for alert in alerts
         )
+        message = "".join(parts)
+    
+    return ToolResult(
+        success=True,
+        message=message,
+        data={"alerts": alerts}
+    )
 
 # ============================================================================
 # TOOL REGISTRY (For Agent)
 # ============================================================================
 
-TOOLS = {
+TOOLS: dict[str, Callable[..., ToolResult]] = {
     "add_expense": add_expense_tool,
+    "add_expenses_bulk": add_expenses_bulk_tool,
     "get_spending_summary": get_spending_summary_tool,
     "set_budget": set_budget_tool,
     "check_budgets": check_budgets_tool,
 }
 
+# Tools that never change data (safe to cache answers that only used these)
+READ_ONLY_TOOLS = frozenset({"get_spending_summary", "check_budgets"})
+
+# ============================================================================
+# POST-TOOL FORMATTERS (Answer read-only results without another LLM call)
+# ============================================================================
+
+def _format_spending_summary(result: ToolResult) -> str:
+    return result.message
+
+def _format_budget_alerts(result: ToolResult) -> str:
+    alerts = result.data["alerts"]
+    if not alerts:
+        return "You're within budget in every category."
+    overages = ", ".join(
+        f"{alert['category']} by {format_money(alert['overage'])}" for alert in alerts
+    )
+    return f"You are over budget in {overages}."
+
+POST_TOOL_FORMATTERS: dict[str, Callable[[ToolResult], str]] = {
+    "get_spending_summary": _format_spending_summary,
+    "check_budgets": _format_budget_alerts,
+}
+
+# Control argument on the formatted tools: the LLM sets it to true only when the
+# tool result alone answers the user. It is stripped before the tool is called
+RESPOND_DIRECTLY_ARG = "respond_directly"
+
 # ============================================================================
 # TOOL SCHEMAS (For LLM to understand tools)
 # ============================================================================
@@ -160,11 +290,32 @@ TOOL_SCHEMAS = {
         },
         "required": ["amount", "category", "description"]
     },
+    "add_expenses_bulk": {
+        "name": "add_expenses_bulk",
+        "description": "Add several expenses at once (use instead of repeated add_expense calls)",
+        "parameters": {
+            "expenses": {
+                "type": "array",
+                "description": "Expenses to add",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "amount": {"type": "number", "description": "Amount in dollars"},
+                        "category": {"type": "string", "description": "Category: food, transport, entertainment, shopping, bills, other"},
+                        "description": {"type": "string", "description": "What was purchased"}
+                    },
+                    "required": ["amount", "category", "description"]
+                }
+            }
+        },
+        "required": ["expenses"]
+    },
     "get_spending_summary": {
         "name": "get_spending_summary",
         "description": "Get spending summary by category",
         "parameters": {
-            "category": {"type": "string", "description": "Optional: specific category to check", "optional": True}
+            "category": {"type": "string", "description": "Optional: specific category to check", "optional": True},
+            "respond_directly": {"type": "boolean", "description": "true only if this result alone answers the user and no other action is needed", "optional": True}
         },
         "required": []
     },
@@ -172,7 +323,7 @@ TOOL_SCHEMAS = {
         "name": "set_budget",
         "description": "Set spending limit for a category",
         "parameters": {
-            "category": {"type": "string", "description": "Category name"},
+            "category": {"type": "string", "description": "Category: food, transport, entertainment, shopping, bills, other"},
             "amount": {"type": "float", "description": "Budget limit in dollars"}
         },
         "required": ["category", "amount"]
@@ -180,12 +331,72 @@ TOOL_SCHEMAS = {
     "check_budgets": {
         "name": "check_budgets",
         "description": "Check if any categories are over budget",
-        "parameters": {},
+        "parameters": {
+            "respond_directly": {"type": "boolean", "description": "true only if this result alone answers the user and no other action is needed", "optional": True}
+        },
         "required": []
     }
 }
 
 
+# ============================================================================
+# OPENAI TOOL SPECS (For native tool calling)
+# ============================================================================
+
+_JSON_TYPES = {"float": "number", "string": "string", "boolean": "boolean"}
+
+def _to_openai_tool(schema: dict) -> dict:
+    """Convert one of our TOOL_SCHEMAS entries into an OpenAI function spec"""
+    properties = {}
+    for param, info in schema["parameters"].items():
+        properties[param] = {
+            "type": _JSON_TYPES.get(info["type"], info["type"]),
+            "description": info["description"]
+        }
+        if "items" in info:
+            properties[param]["items"] = info["items"]
+    return {
+        "type": "function",
+        "function": {
+            "name": schema["name"],
+            "description": schema["description"],
+            "parameters": {
+                "type": "object",
+                "properties": properties,
+                "required": schema["required"]
+            }
+        }
+    }
+
+# Passed to llm.bind_tools() so the model returns validated tool_calls
+LLM_TOOLS = [_to_openai_tool(schema) for schema in TOOL_SCHEMAS.values()]
+
+
+# ============================================================================
+# TOOL DISPATCH (Built once at import, for the agent's tool-call path)
+# ============================================================================
+
+_PY_TYPES = {"float": float, "string": str, "array": list, "boolean": bool}
+
+def _make_validator(schema: dict) -> type[BaseModel]:
+    """Build a pydantic model for a tool's arguments from its TOOL_SCHEMAS entry"""
+    fields = {}
+    for param, info in schema["parameters"].items():
+        py_type = _PY_TYPES[info["type"]]
+        if param in schema["required"]:
+            fields[param] = (py_type, ...)
+        else:
+            fields[param] = (Optional[py_type], None)
+    model_name = schema["name"].title().replace("_", "") + "Args"
+    return create_model(model_name, **fields)
+
+# name -> (tool function, argument validator): one lookup, one validated call.
+# Validators ignore unknown keys, so the LLM can never pass user_id/db itself
+TOOL_DISPATCH: dict[str, tuple[Callable[..., ToolResult], type[BaseModel]]] = {
+    name: (tool_func, _make_validator(TOOL_SCHEMAS[name]))
+    for name, tool_func in TOOLS.items()
+}
+
 # **💡 Separation of Concerns:**
 # """
 # Tool Function                    Repository                Database